@@ -17,6 +17,7 @@ import lxml
 import inspect
 import textwrap
 import datetime
+import functools
 
 from xml2rfc.writers.base import BaseRfcWriter
 from xml2rfc.writers.v2v3 import V2v3XmlWriter
@@ -25,7 +26,7 @@ from collections import deque
 from lxml.etree import Element, ElementTree, ProcessingInstruction, CDATA, Entity, Comment
 
 import id2xml
-from id2xml.utils import Options, Line, wrap, strip_pagebreaks, submission_types
+from id2xml.utils import Options, Line, wrap, strip_pagebreaks, strip_pagebreak_lines, submission_types
 
 try:
     import debug
@@ -180,6 +181,35 @@ reference_patterns = [
 #    r'{anchor}'.format(**reftext_chunks),
 ]
 
+# Patterns applied in the hot per-line and per-token paths below are
+# compiled once here, at import time, rather than being re-compiled (or
+# looked up in re's pattern cache) on every call; the compile cost is
+# then amortized over all the drafts converted in one invocation.
+code_pat =          re.compile(code_re)
+uri_pat =           re.compile(uri_re)
+anchor_start_pat =  re.compile(r'{anchor} '.format(**reftext_chunks))
+draft_name_pat =    re.compile(r'\Wdraft-([a-z0-9-]+)\W')
+draft_rev_pat =     re.compile(r'-[0-9][0-9]$')
+slug_char_pat =     re.compile(r'[^\w\s./-]')
+slug_dash_pat =     re.compile(r'[-\s/]+')
+whitespace_pat =    re.compile(r'\s+')
+http_scheme_pat =   re.compile(r'http://')
+joined_word_pat =   re.compile(r'\S[/-]$')
+broken_word_pat =   re.compile(r'\w[-/]$')
+alnum_pat =         re.compile(r'[A-Za-z0-9]')
+stray_dash_pat =    re.compile(r' [-+]( |$)')
+numdot_pat =        re.compile(r'^[0-9.]+$')
+numref_pat =        re.compile(r'^ref-\d+$')
+tabstop_pat =       re.compile(r'^(\s*\S+(\s\S+)*\s\s+)(\S.*)$')
+figure_space_pat =  re.compile(r'\S   +\S')
+list_marker_pat =   re.compile(r'^[0-9a-z][ivx]*\. ')
+
+# Patterns which are built at runtime (from document content or options)
+# go through this cached compile helper instead:
+@functools.lru_cache(maxsize=256)
+def _compile(regex, flags=0):
+    return re.compile(regex, flags)
+
 # These are used to recognize references which might have bibxml entries.
 # No validation against the bibxml registries is done:
 bibxml_patterns = [
@@ -271,14 +301,14 @@ def parse_section_start(line, numlist, level, appendix):
 def clean_name(txt):
     if txt.endswith('.txt'):
         txt = txt[:-4]
-    if re.search('-[0-9][0-9]$', txt):
+    if draft_rev_pat.search(txt):
         txt = txt[:-3]
     return txt
 
 def slugify(s):
     s = s.strip().lower()
-    s = re.sub(r'[^\w\s./-]', '', s)
-    s = re.sub(r'[-\s/]+', '-', s)
+    s = slug_char_pat.sub('', s)
+    s = slug_dash_pat.sub('-', s)
     s = s.strip('-')
     return s
 
@@ -298,10 +328,10 @@ def flatten(l):
     return list(flatgen(l))
 
 def normalize_space(text):
-    return re.sub('\s+', ' ', text)
+    return whitespace_pat.sub(' ', text)
 
 def normalize_http(text):
-    return re.sub(r'http://', r'https://', text)
+    return http_scheme_pat.sub(r'https://', text)
 
 def strip(para):
     para = para[:]
@@ -314,7 +344,7 @@ def strip(para):
 def para2str(para):
     s = ''
     for ll in [ l.txt.strip() for l in para ]:
-        s += ll if not s or not ll or re.search('\S[/-]$', s) else ' '+ll
+        s += ll if not s or not ll or joined_word_pat.search(s) else ' '+ll
     return s
 
 def para2text(para):
@@ -344,7 +374,7 @@ def parse_date(text):
     ]
 
     for regex in date_regexes:
-        match = re.search(regex, text)
+        match = _compile(regex).search(text)
         if match:
             break
     else:
@@ -460,7 +490,7 @@ def match_name(name, authors):
             briefname = author['initials']+' '+author['surname']
             author['regex'] = make_author_regex(briefname)
         regex = author['regex']
-        if re.match(regex, name):
+        if _compile(regex).match(name):
             return author
 
 def symbol_ratio(text):
@@ -494,27 +524,33 @@ def table_borders(para):
         if line.txt:
             l = ''.join([ ( c if c in symbols else ' ' ) for c in line.txt ]).strip()
             # get rid of solitary dashes which could occur in table cell text
-            if re.search('[A-Za-z0-9]', line.txt):
-                l = re.sub(' [-+]( |$)', r'  \1', l)
+            if alnum_pat.search(line.txt):
+                l = stray_dash_pat.sub(r'  \1', l)
             if l:
                 borders.append(l)
     borders.sort()
     return borders
+
+list_styles = [
+    # Check these in order:
+    ('numbers', re.compile(r'^[1-9][0-9]?\.$')),
+    ('letters', re.compile(r'^[a-z]\.$')),
+    ('symbols', re.compile(r'^[o*+-]$')),
+    ('hanging', re.compile(r'\S.+')),
+    ('empty',   re.compile(r'^$')),
+]
+dspace_chunk_pat =  re.compile(r'^\S+  ')       # doublespace after one nonspace chunk
+dspace_nodot_pat =  re.compile(r'^.+[^.]  ')    # doublespace after arbitrary characters, but no period before spaces
+numlet_marker_pat = re.compile(r'^[1-9a-z]\. ')
+symbol_marker_pat = re.compile(r'^[o*+-] \S')
+
 #@debug.trace
 def guess_list_style(line, slice=None):
-    list_styles = [
-        # Check these in order:
-        ('numbers', r'^[1-9][0-9]?\.$'),
-        ('letters', r'^[a-z]\.$'),
-        ('symbols', r'^[o*+-]$'),
-        ('hanging', r'\S.+'),
-        ('empty',   r'^$'),
-    ]
     text = line.txt
     strp = text.strip()
     ind = indentation(line)
-    if (   re.search('^\S+  ', strp)        # doublespace after one nonspace chunk
-        or re.search('^.+[^.]  ', strp)):   # doublespace after arbitrary characters, but no period before spaces
+    if (   dspace_chunk_pat.search(strp)
+        or dspace_nodot_pat.search(strp)):
         if slice:
             b, e = slice
         else:
@@ -522,16 +558,16 @@ def guess_list_style(line, slice=None):
             e = text.find('  ', b)+2
         marker = text[b:e].rstrip()
         text =   text[e:]
-    elif re.search(r'^[1-9a-z]\. ', strp):
+    elif numlet_marker_pat.search(strp):
         marker, text = strp.split(None, 1)
-    elif re.search(r'^[o*+-] \S', strp):
+    elif symbol_marker_pat.search(strp):
         marker, text = strp.split(None, 1)
     else:
         marker = strp
         text = ''
     style = None
     for name, regex in list_styles:
-        if re.search(regex, marker):
+        if regex.search(marker):
             style = name
             break
     return style, marker, ind, text
@@ -742,7 +778,7 @@ class TextParser(Base):
             if tok.strip() != '':
                 self.stack.push(tok)
                 break
-        tok = '' if self.prev and re.search(r'\w[-/]$', self.prev) else ' '
+        tok = '' if self.prev and broken_word_pat.search(self.prev) else ' '
         return tok
 
     @dtrace
@@ -772,7 +808,7 @@ class TextParser(Base):
             return self.stack.pop()
         keyword, space, number = parts
         self.dshow('number')
-        if not re.search('^[0-9.]+$', number):
+        if not numdot_pat.match(number):
             return self.stack.pop()
         else:
             section = number.rstrip('.')
@@ -857,11 +893,11 @@ class TextParser(Base):
                     tok = self.docparser.element('xref', target=target)
             elif tok in self.angles:
                 tok = self.get_quoted(tok)
-                match = re.search(uri_re, tok)
+                match = uri_pat.search(tok)
                 if match:
                     target= match.group('target')
                     tok = self.docparser.element('eref', target=target)
-            elif re.search(uri_re, tok):
+            elif uri_pat.search(tok):
                 uri = tok
                 tok = self.pop()
                 if tok == '':
@@ -870,7 +906,7 @@ class TextParser(Base):
                 else:
                     self.push(tok)
                 self.dshow('uri')
-                match = re.search(uri_re, uri)
+                match = uri_pat.search(uri)
                 target= match.group('target')
                 tok = self.docparser.element('eref', target=target)
             elif tok == '\n':
@@ -906,13 +942,6 @@ class DraftParser(Base):
     root = None
     name = None
     schema = None
-    entities = []
-    pi = {}
-    #
-    _identify_paragraph_cache = {}
-    section_anchors = []
-    reference_anchors = []
-    anchor_replacements = {}
 
     rfc_pi_defaults = {
         'strict': 'yes',
@@ -926,20 +955,44 @@ class DraftParser(Base):
     }
 
     def __init__(self, name, text, options):
+        # mutable per-document state; must not be shared between
+        # parser instances when several drafts are converted in one
+        # process
+        self.entities = []
+        self.pi = {}
+        self._identify_paragraph_cache = {}
+        self.section_anchors = []
+        self.reference_anchors = []
+        self.anchor_replacements = {}
+        #
         self.options = options
         self.name = name
         self.is_draft = name.startswith('draft-')
         self.is_rfc = name.lower().startswith('rfc')
         if not (self.is_draft or self.is_rfc):
             self.err(0, "Expected the input document name to start with either 'draft-' or 'rfc'")
-        assert type(text) is six.text_type # unicode in 2.x, str in 3.x.  
+        assert type(text) is six.text_type # unicode in 2.x, str in 3.x.
         self.raw = text
+        self.raw_lines = None
         schema_file = os.path.join(os.path.dirname(__file__), 'data', 'v2.rng')
         self.schema = ElementTree(file=schema_file)
         self.rfc_attr = self.schema.xpath("/x:grammar/x:define/x:element[@name='rfc']//x:attribute", namespaces=ns)
         self.rfc_attr_defaults = dict( (a.get('name'), a.get("{%s}defaultValue"%ns['a'], None)) for a in self.rfc_attr )
         self.e = None
 
+    @classmethod
+    def from_lines(cls, name, lines, options):
+        """
+        Alternative constructor which takes the document as an iterable of
+        lines, as returned by readlines(), rather than as one big string.
+        This avoids building (and passing around) a whole-document string
+        which the parser would only split into lines again.
+        """
+        self = cls(name, '', options)
+        self.raw = None
+        self.raw_lines = lines
+        return self
+
     @dtrace
     def get_tabstop(self, line):
         """
@@ -947,7 +1000,7 @@ class DraftParser(Base):
         of any text which follows more than one space, relative
         to the left margin at column 3.
         """
-        match = re.search(r'^(\s*\S+(\s\S+)*\s\s+)(\S.*)$', line.txt)
+        match = tabstop_pat.search(line.txt)
         if match:
             # return co
             return max(2, len(match.group(1)) - 3)
@@ -974,7 +1027,10 @@ class DraftParser(Base):
         return self.pi['text-list-symbols']
 
     def parse_to_xml(self, **kwargs):
-        self.lines, self.short_title = strip_pagebreaks(self.raw.expandtabs())
+        if self.raw is None:
+            self.lines, self.short_title = strip_pagebreak_lines(l.expandtabs() for l in self.raw_lines)
+        else:
+            self.lines, self.short_title = strip_pagebreaks(self.raw.expandtabs())
         self.l = -1
         self.p = None
 
@@ -1237,7 +1293,7 @@ class DraftParser(Base):
             self.p = None
         if self.options.debug:
             if self.options.trace_start_regex and not self.options.trace_all:
-                if line and re.search(self.options.trace_start_regex, line.txt.strip()) != None:
+                if line and _compile(self.options.trace_start_regex).search(line.txt.strip()) != None:
                     self.options.trace_all = True
             if self.options.trace_start_line and not self.options.trace_all:
                 if line and line.num == self.options.trace_start_line:
@@ -1245,7 +1301,7 @@ class DraftParser(Base):
             if self.options.trace_all:
                 if line and (line.num == self.options.trace_start_line
                              or (self.options.trace_start_regex
-                                 and re.search(self.options.trace_start_regex, line.txt.strip())) != None):
+                                 and _compile(self.options.trace_start_regex).search(line.txt.strip())) != None):
                     # reset the tail count on every new ocurrence of the start pattern
                     self.options.trace_tail = -1
                 #
@@ -1256,7 +1312,7 @@ class DraftParser(Base):
                     self.options.trace_all = False
                 elif (line and self.options.trace_stop_line == line.num
                       or (line and self.options.trace_stop_regex
-                          and re.search(self.options.trace_stop_regex, line.txt.strip()) != None)):
+                          and _compile(self.options.trace_stop_regex).search(line.txt.strip()) != None)):
                     self.options.trace_tail = self.options.trailing_trace_lines
 
         self.dshow('line')
@@ -1376,7 +1432,7 @@ class DraftParser(Base):
                 # check all the possible top left keywords:
                 for k in entries:
                     regex = entries[k]['regex']
-                    if regex and re.search(regex, line.txt):
+                    if regex and _compile(regex).search(line.txt):
                         # no explicit workgroup.  remember line, and move on
                         res.workgroup = ""
                         lines.insert(0, line)
@@ -1552,7 +1608,7 @@ class DraftParser(Base):
             for k in entries:
                 v = entries[k]
                 regex = v['regex']
-                if regex and re.search(regex, next.txt):
+                if regex and _compile(regex).search(next.txt):
                     v['function'](self, lines, res)
                     v['needed'] = False
                     break
@@ -1612,14 +1668,14 @@ class DraftParser(Base):
                 self.warn(line.num, "Unexpected text: expected blank lines after document date, found '%s'" % (line, ))
                 continue
             for regex in editorformats:
-                if re.search(regex, txt):
-                    txt = re.sub(regex, "", txt)
+                if _compile(regex).search(txt):
+                    txt = _compile(regex).sub("", txt)
                     #debug.say('found editor')
                     #debug.show('txt')
                     is_editor = True
                     break
             for regex in authorformats:
-                match = re.search(regex, txt)
+                match = _compile(regex).search(txt)
                 if match:
                     author = {
                         'fullname': match.group(1).strip(),
@@ -1634,7 +1690,7 @@ class DraftParser(Base):
                     self.authors.append(author)
                     break
             else:
-                if re.search(dateformat, txt):
+                if _compile(dateformat).search(txt):
                     date = parse_date(txt)
                     continue
                 else:
@@ -1900,7 +1956,7 @@ class DraftParser(Base):
             match = re.search(appendix_prefix, text)
             if match:
                 text = text[len(match.group(0)):]
-        return re.search('^%s([. ]|$)'%'.'.join(numlist), text) != None if numlist else re.search(section_start_re[part], text.lower()) != None
+        return _compile('^%s([. ]|$)'%'.'.join(numlist)).search(text) != None if numlist else _compile(section_start_re[part]).search(text.lower()) != None
 
     @dtrace
     def read_author_name(self):
@@ -2182,7 +2238,7 @@ class DraftParser(Base):
             text = '\n'+para2text(flat)
             if tag == 'list':
                 for b in block:
-                    if re.search(code_re, para2text(b)):
+                    if code_pat.search(para2text(b)):
                         # in vocabulary v3 this will be 'sourcecode'
                         tag = 'figure'
                         block = [ flat ]
@@ -2264,16 +2320,16 @@ class DraftParser(Base):
                     self.dshow('linecount')
                     self.dshow('len(indents)')
                     next = self.next_line()
-                    if re.search(code_re, line.txt):
+                    if code_pat.search(line.txt):
                         self.dsay('... figure (matches code regex)')
                         tag = 'figure'
-                    elif len(re.findall('\S   +\S', text)) > 2:
+                    elif len(figure_space_pat.findall(text)) > 2:
                         self.dsay('... figure (matches odd whitespace regex)')
                         tag = 'figure'
                     elif (
                         len(indents) > 1
                         or (linecount == 1 and line.txt.strip()[:2] in ['o ', '* ', '+ ', '- ', ]) 
-                        or (linecount == 1 and re.search('^[0-9a-z][ivx]*\. ', line.txt.strip()))
+                        or (linecount == 1 and list_marker_pat.search(line.txt.strip()))
                         or (next and indentation(next) > indentation(para[0]) and linecount == 1)
                         or ('  ' in line.txt.strip() and not '.  ' in line.txt.strip())
                         ):
@@ -2930,7 +2986,7 @@ class DraftParser(Base):
         self.dshow('text')
         faild = None
         for regex in reference_patterns:
-            match = re.search(regex, text)
+            match = regex.search(text)
             if match:
                 if faild:
                     self.dshow('faild')
@@ -3092,14 +3148,14 @@ class DraftParser(Base):
         line = para[0]
         text = para2str(para)
         entity = None
-        match = re.search(r'{anchor} '.format(**reftext_chunks), text)
+        match = anchor_start_pat.search(text)
         if match:
             refinfo = match.groupdict()
             self.dpprint('refinfo')
             anchor = refinfo.get('anchor')
             for item in bibxml_patterns:
                 regex, start, series, url = item
-                m = re.search(regex, anchor)
+                m = _compile(regex).search(anchor)
                 if m:
                     self.warn(line.num, "Failed parsing a reference.  Will use the anchor to insert an %s reference for:\n%s" % (series, para2text(para)))
                     value = anchor[start:]
@@ -3122,9 +3178,9 @@ class DraftParser(Base):
             regex, start, series, url = item
             if series == 'I-D':
                 break
-        amatch = re.search(r'{anchor} '.format(**reftext_chunks), text)
+        amatch = anchor_start_pat.search(text)
         self.dshow('amatch')
-        dmatch = re.search('\Wdraft-([a-z0-9-]+)\W', text)
+        dmatch = draft_name_pat.search(text)
         self.dshow('dmatch')
         if amatch and dmatch:
             oldanchor = amatch.groupdict().get('anchor')
@@ -3182,7 +3238,7 @@ class DraftParser(Base):
             self.err(0, "Internal error: set_symref_pi() called without reference_anchors having been set")
         symrefs = "no"
         for anchor in self.reference_anchors:
-            if anchor and not re.search('^ref-\d+$', anchor):
+            if anchor and not numref_pat.search(anchor):
                 symrefs = "yes"
         self.pi['symrefs'] = symrefs
         pi = ProcessingInstruction('rfc', 'symrefs="%s"'%symrefs)
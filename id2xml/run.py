@@ -48,9 +48,22 @@ COPYRIGHT
 
 from __future__ import print_function, unicode_literals, division
 
+import argparse
+import copy
+import functools
+import io
+import multiprocessing
+import os
+import sys
+
+try:
+    from pathlib import Path
+except ImportError:
+    from pathlib2 import Path
+
 from id2xml.__init__ import __version__
 from id2xml.parser import DraftParser
-from id2xml.utils import Options, wrap, strip_pagebreaks, stream_names
+from id2xml.utils import Options, wrap, strip_pagebreaks_text, stream_names
 
 try:
     import debug
@@ -67,18 +80,43 @@ _prolog, _middle, _epilog = __doc__.split('...')
 
 # ----------------------------------------------------------------------
 #
-# This is the entrypoint which is invoked from command-line scripts:
-
-def run():
-    import sys, os, argparse
-    from pathlib2 import Path
-    global _prolog, _middle, _epilog
+# Each draft is an independent conversion task, so batch invocations farm
+# the files out to a multiprocessing pool.  A worker reads and converts
+# one draft and hands the resulting text back; all output file writing is
+# done in the parent process.  The argument is a plain tuple (and options
+# travel as a dict) so it pickles cheaply.
+
+def _convert_one(args):
+    (path_str, conf, strip_only) = args
+    options = Options(**conf)
+    inf = Path(path_str)
+    try:
+        if strip_only:
+            with inf.open() as fh:
+                payload = strip_pagebreaks_text(fh.read())
+        else:
+            # hand the parser the lines directly; building one big
+            # document string here would only be split up again
+            with inf.open() as fh:
+                parser = DraftParser.from_lines(inf.name, fh.readlines(), options=options)
+            payload = parser.parse_to_xml()
+        return (inf.name, payload, None)
+    except Exception as e:
+        return (inf.name, None, e)
+    except SystemExit as e:
+        # DraftParser.err() reports document errors by writing a message
+        # and exiting; in a pool worker that would kill the worker and
+        # leave the parent waiting forever for the result, so hand the
+        # exit back to the parent instead
+        return (inf.name, None, e)
 
-    program = os.path.basename(sys.argv[0])
-    #progdir = os.path.dirname(sys.argv[0])
+# ----------------------------------------------------------------------
+# Parse config file
+# Cached, so that callers which import id2xml and invoke run() repeatedly
+# don't redo the stat calls and the rc-file read on every invocation.
 
-    # ----------------------------------------------------------------------
-    # Parse config file
+@functools.lru_cache(maxsize=4)
+def _load_rc(cwd, home):
     # default values
     conf = {
         'logindent':        [4],
@@ -89,14 +127,38 @@ def run():
 #        'rfc_url':          'https://tools.ietf.org/html/rfc{number}#{fragment}',
 #        'draft_url':        'https://tools.ietf.org/html/{draft}#{fragment}',
         }
-    for p in ['.', os.environ.get('HOME','.'), '/etc/', ]:
-        rcpath = Path(p)
-        if rcpath.exists():
-            rcfn = rcpath / '.id2xmlrc'
-            if rcfn.exists():
-                execfile(str(rcfn), conf)
-                break
-    options = Options(**conf)
+    for p in (cwd, home, '/etc/', ):
+        rcfn = os.path.join(p, '.id2xmlrc')
+        # one stat per candidate; a nonexistent directory just comes
+        # back False from isfile()
+        if os.path.isfile(rcfn):
+            with open(rcfn) as fh:
+                exec(fh.read(), conf)
+            break
+    return conf
+
+# ----------------------------------------------------------------------
+#
+# This is the entrypoint which is invoked from command-line scripts:
+
+def run():
+    global _prolog, _middle, _epilog
+
+    program = os.path.basename(sys.argv[0])
+    #progdir = os.path.dirname(sys.argv[0])
+
+    # Fast path: all that's needed for -V is the version string, so skip
+    # the rc-file lookup and the (surprisingly heavy) construction of the
+    # argument parser
+    if len(sys.argv) == 2 and sys.argv[1] in ('-V', '--version'):
+        print(program, __version__)
+        sys.exit(0)
+
+    # deep-copy the cached conf values per invocation: the trace
+    # machinery mutates the logindent list in place, and cached state
+    # must not leak from one run() call into the next
+    conf = _load_rc(os.getcwd(), os.environ.get('HOME', '.'))
+    options = Options(**{ k: copy.deepcopy(v) for k, v in conf.items() if not k.startswith('__') })
 
     # ----------------------------------------------------------------------
     def say(s):
@@ -198,45 +260,72 @@ def run():
         and not (options.trace_stop_regex or options.trace_stop_line )):
         die("If you set a trace start condition, you must also set a trace stop condition")
 
-    for file in options.DRAFT:
-        try:
-            inf = Path(file)
-            #name = re.sub('-[0-9][0-9]', '', inf.stem)
-            if options.output_file:
-                # This is not what we want if options.output_file=='-', but we fix
-                # that in the 'with' clause below
-                outf = Path(options.output_file)
-            elif options.output_path:
-                outf = Path(options.output_path) / (inf.stem+output_suffix)
-            else:
-                outf = inf.with_suffix(output_suffix)
-                # if we're using an implicit output file name (derived from the
-                # input file name), and we're not just stripping headers, refuse
-                # to overwrite an existing file.  It could be the original xml
-                # file provided by the authors.
-                if not options.strip_only and outf.exists():
-                    die("The implied output file (%s) already exists.  Provide an explicit "
-                        "output filename (with -o) or a directory path (with -p) if you want "
-                        "%s to overwrite an existing file." % (outf, program, ))
-            with inf.open() as file:
-                txt = file.read()
-            if options.strip_only:
-                note(" Stripping '%s'" % (inf.name, ))
-                lines, __ = strip_pagebreaks(txt)
-                with (sys.stdout if options.output_file=='-' else outf.open('w')) as out:
-                    out.write('\n'.join([l.txt for l in lines]))
-                    out.write('\n')
-                note(" Written to '%s'" % out.name)
-            else:
-                note(" Converting '%s'" % (inf.name, ))
-                parser = DraftParser(inf.name, txt, options=options)
-                xml = parser.parse_to_xml()
-                with (sys.stdout if options.output_file=='-' else outf.open('w')) as out:
-                    out.write(xml)
-                note(" Written to '%s'" % out.name)
-        except Exception as e:
-            sys.stderr.write("Failure converting %s: %s\n" % (inf.name, e))
-            raise
+    # Resolve all input and output file names up front, before any
+    # conversion work starts; the job list is then handed to the
+    # conversion workers below, which do their own reading.
+    jobs = []
+    for path_str in options.DRAFT:
+        inf = Path(path_str)
+        #name = re.sub('-[0-9][0-9]', '', inf.stem)
+        if options.output_file:
+            # This is not what we want if options.output_file=='-', but we fix
+            # that in the 'with' clause below
+            outf = Path(options.output_file)
+        elif options.output_path:
+            outf = Path(options.output_path) / (inf.stem+output_suffix)
+        else:
+            outf = inf.with_suffix(output_suffix)
+        jobs.append((inf, outf))
+
+    def open_out(outf):
+        # open with a large buffer; it turns the many small buffered
+        # writes of a multi-MB document into few large write syscalls
+        if options.output_file == '-':
+            return sys.stdout
+        if not options.strip_only and not (options.output_file or options.output_path):
+            # with an implicit output file name (derived from the input
+            # file name), refuse to overwrite an existing file -- it
+            # could be the original xml file provided by the authors.
+            # O_EXCL makes the check-and-create atomic, rather than a
+            # separate exists() test which another process could race
+            # the opener callback (rather than os.open()+io.open(fd))
+            # keeps out.name as the file name instead of the descriptor
+            def excl_opener(fn, flags):
+                return os.open(fn, flags | os.O_EXCL)
+            try:
+                return io.open(str(outf), 'w', encoding='utf-8', buffering=1<<20, opener=excl_opener)
+            except FileExistsError:
+                die("The implied output file (%s) already exists.  Provide an explicit "
+                    "output filename (with -o) or a directory path (with -p) if you want "
+                    "%s to overwrite an existing file." % (outf, program, ))
+        return io.open(str(outf), 'w', encoding='utf-8', buffering=1<<20)
+
+    def write_result(job, result):
+        inf, outf = job
+        name, payload, e = result
+        if e is not None:
+            if isinstance(e, SystemExit):
+                # the error message was already written when the
+                # worker's parser called err()
+                raise e
+            sys.stderr.write("Failure converting %s: %s\n" % (name, e))
+            raise e
+        note(" %s '%s'" % ('Stripping' if options.strip_only else 'Converting', name, ))
+        with open_out(outf) as out:
+            out.write(payload)
+        note(" Written to '%s'" % out.name)
+
+    arglist = [ (str(inf), vars(options), options.strip_only) for inf, outf in jobs ]
+    if len(jobs) > 1:
+        # Each draft is CPU-bound and independent, so use one worker per
+        # core and write the results as they stream back, in order
+        with multiprocessing.Pool() as pool:
+            for job, result in zip(jobs, pool.imap(_convert_one, arglist, chunksize=1)):
+                write_result(job, result)
+    else:
+        # don't pay the fork overhead for a single draft
+        for job, result in zip(jobs, map(_convert_one, arglist)):
+            write_result(job, result)
 
 
 if __name__ == '__main__':
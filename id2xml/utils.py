@@ -55,6 +55,20 @@ def wrap(s, w=120):
 
 def strip_pagebreaks(text):
     "Strip ID/RFC-style headers and footers from the given text"
+    # We need to get rid of the \f, otherwise those will result in extra lines during line
+    # splitting, and the line numbers reported in error messages will be off
+    text = text.replace('\f','')
+    return strip_pagebreak_lines(text.splitlines())
+
+def strip_pagebreaks_text(text):
+    """Strip ID/RFC-style headers and footers from the given text, and
+    return the stripped text directly, for callers which don't need the
+    per-line number metadata carried by the Line objects."""
+    lines, __ = strip_pagebreak_lines(text.replace('\f','').splitlines(), mkline=lambda num, txt: txt)
+    return '\n'.join(lines) + '\n'
+
+def strip_pagebreak_lines(lines, mkline=Line):
+    "Strip ID/RFC-style headers and footers from the given iterable of lines"
     short_title = None
     stripped = []
     page = []
@@ -62,10 +76,6 @@ def strip_pagebreaks(text):
     newpage = False
     sentence = False
     blankcount = 0
-    # We need to get rid of the \f, otherwise those will result in extra lines during line
-    # splitting, and the line numbers reported in error messages will be off
-    text = text.replace('\f','') 
-    lines = text.splitlines()
     # two functions with side effects
     def endpage(page, newpage, line):
         if line:
@@ -79,7 +89,9 @@ def strip_pagebreaks(text):
             page += [ line ]
         return page, newpage
     for lineno, line in enumerate(lines):
-        line = line.rstrip()
+        # the \f replace is a no-op when we were handed pre-split text;
+        # it matters when the lines come straight from readlines()
+        line = line.replace('\f','').rstrip()
         match = re.search("(  *)(\S.*\S)(  +)\[?[Pp]age [0-9ivx]+\]?[ \t\f]*$", line, re.I)
         if match:
             mid = match.group(2)
@@ -129,10 +141,10 @@ def strip_pagebreaks(text):
         if re.search("[^ \t]", line):
             if newpage:
                 if sentence:
-                    stripped += [ Line(lineno-1, "") ]
+                    stripped += [ mkline(lineno-1, "") ]
             else:
                 if blankcount:
-                    stripped += [ Line(lineno-1, "") ]
+                    stripped += [ mkline(lineno-1, "") ]
             blankcount = 0
             sentence = False
             newpage = False
@@ -157,7 +169,7 @@ def strip_pagebreaks(text):
             page += [ line ]
             continue
         page += [ line ]
-        stripped += [ Line(lineno, line) ]
+        stripped += [ mkline(lineno, line) ]
     page, newpage = begpage(page, newpage)
     return stripped, short_title
     
\ No newline at end of file